@@ -4,21 +4,55 @@ export SM_CYTHON_COVERAGE=1
 python setup.py develop
 pytest --cov=statsmodels statsmodels
 coverage html
+
+To set the number of parallel jobs used when building
+export SM_BUILD_JOBS=2
+Both Cython code generation and C compilation are serial by default. For
+C compilation python setup.py build_ext -j N takes precedence. Cython only
+runs in parallel on platforms where multiprocessing uses fork, since
+setup.py cannot be re-imported safely by spawned worker processes.
+
+To build optimized for the host CPU (-O3 -ffast-math -fno-finite-math-only
+-funroll-loops -march=native, or /O2 /fp:fast /arch:AVX2 with MSVC)
+export SM_BUILD_NATIVE=1
+python setup.py develop
+The binaries will not run on older CPUs, and fast math relaxes IEEE
+semantics, so this is not suitable for distributed builds.
+statsmodels.tsa._stl finds missing values with C isnan, which fast math
+can fold to false, so it is always built without these flags.
 """
 from collections import defaultdict
 from distutils.command.clean import clean
-import fnmatch
+import glob
+import multiprocessing
 import os
-from os.path import abspath, join as pjoin, relpath, split
+from os.path import abspath, join as pjoin, split
 import shutil
 import sys
 
-import pkg_resources
 from setuptools import Extension, find_packages, setup
 from setuptools.dist import Distribution
 
 import versioneer
 
+try:
+    from packaging.version import Version
+except ImportError:
+    # packaging is a build requirement but may be missing in legacy builds
+    from distutils.version import LooseVersion as Version
+
+# Commands that only report metadata or exit do not need the extensions,
+# package data or dependency checks
+NO_FRILLS_COMMANDS = ('--help-commands', '--name', '--version', '-V',
+                      '--fullname', '--author', '--author-email',
+                      '--maintainer', '--maintainer-email', '--contact',
+                      '--contact-email', '--url', '--license',
+                      '--description', '--long-description', '--platforms',
+                      '--classifiers', '--keywords', 'clean')
+NO_FRILLS = (len(sys.argv) > 1 and
+             (sys.argv[1] in NO_FRILLS_COMMANDS or
+              '--help' in sys.argv[1:] or '-h' in sys.argv[1:]))
+
 try:
     # SM_FORCE_C is a testing shim to force setup to use C source files
     FORCE_C = int(os.environ.get('SM_FORCE_C', 0))
@@ -26,7 +60,11 @@ try:
         raise ImportError('Force import error for testing')
     from Cython import Tempita
     from Cython.Build import cythonize
-    from Cython.Distutils import build_ext
+    try:
+        # new_build_ext respects --parallel when compiling C sources
+        from Cython.Distutils.build_ext import new_build_ext as build_ext
+    except ImportError:
+        from Cython.Distutils import build_ext
 
     HAS_CYTHON = True
 except ImportError:
@@ -46,19 +84,45 @@ REQ_NOT_MET_MSG = """
 {0} is installed but older ({1}) than required ({2}). You must manually
 upgrade {0} before installing or install into a fresh virtualenv.
 """
-for key in SETUP_REQUIREMENTS:
+
+
+def installed_version(package):
+    """
+    Version of an installed package, or None if it is not installed
+
+    Reads the distribution metadata when possible to avoid importing the
+    package, and falls back to importing it when the metadata is missing,
+    e.g., for in-place builds on PYTHONPATH.
+    """
+    try:
+        from importlib.metadata import PackageNotFoundError, version
+    except ImportError:
+        try:
+            from importlib_metadata import PackageNotFoundError, version
+        except ImportError:
+            version = None
+    if version is not None:
+        try:
+            return version(package)
+        except PackageNotFoundError:
+            pass
     import importlib
-    from distutils.version import LooseVersion
-    req_ver = LooseVersion(SETUP_REQUIREMENTS[key])
     try:
-        mod = importlib.import_module(key)
-        ver = LooseVersion(mod.__version__)
-        if ver < req_ver:
-            raise RuntimeError(REQ_NOT_MET_MSG.format(key, ver, req_ver))
+        return importlib.import_module(package).__version__
     except ImportError:
-        pass
-    except AttributeError:
-        raise RuntimeError(REQ_NOT_MET_MSG.format(key, ver, req_ver))
+        return None
+
+
+if not NO_FRILLS:
+    min_versions = {key: Version(ver)
+                    for key, ver in SETUP_REQUIREMENTS.items()}
+    for key, req_ver in min_versions.items():
+        try:
+            ver = installed_version(key)
+        except AttributeError:
+            raise RuntimeError(REQ_NOT_MET_MSG.format(key, None, req_ver))
+        if ver is not None and Version(ver) < req_ver:
+            raise RuntimeError(REQ_NOT_MET_MSG.format(key, ver, req_ver))
 
 INSTALL_REQUIREMENTS = SETUP_REQUIREMENTS.copy()
 INSTALL_REQUIREMENTS.update({'pandas': '0.21',  # released October 2017
@@ -68,6 +132,9 @@ INSTALL_REQUIREMENTS.update({'pandas': '0.21',  # released October 2017
 CYTHON_MIN_VER = '0.29'  # released November 2018
 
 SETUP_REQUIRES = [k + '>=' + v for k, v in SETUP_REQUIREMENTS.items()]
+if NO_FRILLS:
+    # Avoid fetching build dependencies for commands that do not build
+    SETUP_REQUIRES = []
 INSTALL_REQUIRES = [k + '>=' + v for k, v in INSTALL_REQUIREMENTS.items()]
 
 EXTRAS_REQUIRE = {'build': ['cython>=' + CYTHON_MIN_VER],
@@ -82,7 +149,7 @@ EXTRAS_REQUIRE = {'build': ['cython>=' + CYTHON_MIN_VER],
 DISTNAME = 'statsmodels'
 DESCRIPTION = 'Statistical computations and models for Python'
 SETUP_DIR = split(abspath(__file__))[0]
-with open(pjoin(SETUP_DIR, 'README.rst')) as readme:
+with open(pjoin(SETUP_DIR, 'README.rst'), encoding='utf-8') as readme:
     README = readme.read()
 LONG_DESCRIPTION = README
 MAINTAINER = 'statsmodels Developers'
@@ -115,7 +182,7 @@ FILES_TO_INCLUDE_IN_PACKAGE = ['LICENSE.txt', 'setup.cfg']
 
 FILES_COPIED_TO_PACKAGE = []
 for filename in FILES_TO_INCLUDE_IN_PACKAGE:
-    if os.path.exists(filename):
+    if os.path.exists(filename) and not NO_FRILLS:
         dest = os.path.join('statsmodels', filename)
         shutil.copy2(filename, dest)
         FILES_COPIED_TO_PACKAGE.append(dest)
@@ -138,11 +205,42 @@ ADDITIONAL_PACKAGE_DATA = {
 ##############################################################################
 CYTHON_COVERAGE = os.environ.get('SM_CYTHON_COVERAGE', False)
 CYTHON_COVERAGE = CYTHON_COVERAGE in ('1', 'true', '"true"')
-CYTHON_TRACE_NOGIL = str(int(CYTHON_COVERAGE))
+COMPILER_DIRECTIVES = {}
+DEFINE_MACROS = []
 if CYTHON_COVERAGE:
     print('Building with coverage for Cython code')
-COMPILER_DIRECTIVES = {'linetrace': CYTHON_COVERAGE}
-DEFINE_MACROS = [('CYTHON_TRACE_NOGIL', CYTHON_TRACE_NOGIL)]
+    COMPILER_DIRECTIVES['linetrace'] = True
+    DEFINE_MACROS.append(('CYTHON_TRACE_NOGIL', '1'))
+
+
+def parse_build_jobs(value):
+    """Number of build jobs requested in SM_BUILD_JOBS, or None if unset"""
+    if value is None:
+        return None
+    try:
+        return max(int(value), 1)
+    except ValueError:
+        print('Ignoring SM_BUILD_JOBS={!r} since it is not an '
+              'integer'.format(value))
+        return None
+
+
+REQUESTED_BUILD_JOBS = parse_build_jobs(os.environ.get('SM_BUILD_JOBS'))
+# 0 runs cythonize serially. Its worker pool is only safe with fork since
+# spawned workers re-run this unguarded module. The first start method is
+# the default, and querying it this way does not fix the start method.
+START_METHOD = (multiprocessing.get_start_method(allow_none=True) or
+                multiprocessing.get_all_start_methods()[0])
+CYTHON_JOBS = 0
+if REQUESTED_BUILD_JOBS is not None and START_METHOD == 'fork':
+    CYTHON_JOBS = REQUESTED_BUILD_JOBS
+BUILD_NATIVE = os.environ.get('SM_BUILD_NATIVE', False)
+BUILD_NATIVE = BUILD_NATIVE in ('1', 'true', '"true"')
+NATIVE_COMPILE_ARGS = {'msvc': ['/O2', '/fp:fast', '/arch:AVX2'],
+                       'unix': ['-O3', '-ffast-math', '-fno-finite-math-only',
+                                '-funroll-loops', '-march=native']}
+# Extensions that rely on C isnan to detect missing values
+NATIVE_EXCLUDED_EXTENSIONS = ['statsmodels.tsa._stl']
 
 
 exts = dict(
@@ -176,6 +274,9 @@ statespace_exts = [
     'statsmodels/tsa/statespace/_cfa_simulation_smoother.pyx.in',
     'statsmodels/tsa/statespace/_tools.pyx.in',
 ]
+# Shared by all statespace extensions
+statespace_ext_config = {'include_dirs': ['statsmodels/src'], 'depends': [],
+                         'libraries': [], 'library_dirs': []}
 
 
 class CleanCommand(clean):
@@ -196,18 +297,33 @@ Use one of:
 class DeferredBuildExt(build_ext):
     """build_ext command for use when numpy headers are needed."""
 
+    def finalize_options(self):
+        super().finalize_options()
+        if not self.parallel and REQUESTED_BUILD_JOBS is not None:
+            self.parallel = REQUESTED_BUILD_JOBS
+
     def build_extensions(self):
         self._update_extensions()
-        build_ext.build_extensions(self)
+        if BUILD_NATIVE:
+            self._add_native_compile_args()
+        super().build_extensions()
+
+    def _add_native_compile_args(self):
+        compiler_type = self.compiler.compiler_type
+        native_args = NATIVE_COMPILE_ARGS.get(compiler_type,
+                                              NATIVE_COMPILE_ARGS['unix'])
+        print('Building for the host CPU with ' + ' '.join(native_args))
+        for extension in self.extensions:
+            if extension.name in NATIVE_EXCLUDED_EXTENSIONS:
+                continue
+            extension.extra_compile_args = (extension.extra_compile_args +
+                                            native_args)
 
     def _update_extensions(self):
         import numpy
         from numpy.distutils.misc_util import get_info
 
         numpy_includes = [numpy.get_include()]
-        extra_incl = pkg_resources.resource_filename('numpy', 'core/include')
-        numpy_includes += [extra_incl]
-        numpy_includes = list(set(numpy_includes))
         numpy_math_libs = get_info('npymath')
 
         for extension in self.extensions:
@@ -216,9 +332,12 @@ class DeferredBuildExt(build_ext):
             extension.include_dirs = list(set(extension.include_dirs +
                                               numpy_includes))
             if extension.name in EXT_REQUIRES_NUMPY_MATH_LIBS:
+                # Rebind rather than extend since these lists may be shared
                 extension.include_dirs += numpy_math_libs['include_dirs']
-                extension.libraries += numpy_math_libs['libraries']
-                extension.library_dirs += numpy_math_libs['library_dirs']
+                extension.libraries = (extension.libraries +
+                                       numpy_math_libs['libraries'])
+                extension.library_dirs = (extension.library_dirs +
+                                          numpy_math_libs['library_dirs'])
 
 
 cmdclass = versioneer.get_cmdclass()
@@ -243,78 +362,65 @@ def check_source(source_name):
 def process_tempita(source_name):
     """Runs pyx.in files through tempita is needed"""
     if source_name.endswith('pyx.in'):
-        with open(source_name, 'r') as templated:
+        pyx_filename = source_name[:-3]
+        file_stats = os.stat(source_name)
+        # The generated pyx is given the template's mtime, so a match means
+        # it is up to date and Cython can reuse its existing output
+        if (os.path.exists(pyx_filename) and
+                os.stat(pyx_filename).st_mtime_ns == file_stats.st_mtime_ns):
+            return pyx_filename
+        with open(source_name, 'r', encoding='utf-8') as templated:
             pyx_template = templated.read()
         pyx = Tempita.sub(pyx_template)
-        pyx_filename = source_name[:-3]
-        with open(pyx_filename, 'w') as pyx_file:
+        with open(pyx_filename, 'w', encoding='utf-8') as pyx_file:
             pyx_file.write(pyx)
-        file_stats = os.stat(source_name)
-        try:
-            os.utime(pyx_filename, ns=(file_stats.st_atime_ns,
-                                       file_stats.st_mtime_ns))
-        except AttributeError:
-            os.utime(pyx_filename, (file_stats.st_atime, file_stats.st_mtime))
+        os.utime(pyx_filename, ns=(file_stats.st_atime_ns,
+                                   file_stats.st_mtime_ns))
         source_name = pyx_filename
     return source_name
 
 
-EXT_REQUIRES_NUMPY_MATH_LIBS = []
-extensions = []
-for config in exts.values():
-    uses_blas = True
-    source, ext = check_source(config['source'])
-    source = process_tempita(source)
-    name = source.replace('/', '.').replace(ext, '')
-    include_dirs = config.get('include_dirs', [])
-    depends = config.get('depends', [])
-    libraries = config.get('libraries', [])
-    library_dirs = config.get('library_dirs', [])
-
-    uses_numpy_libraries = config.get('numpy_libraries', False)
-    if uses_blas or uses_numpy_libraries:
-        EXT_REQUIRES_NUMPY_MATH_LIBS.append(name)
-
-    ext = Extension(name, [source],
-                    include_dirs=include_dirs, depends=depends,
-                    libraries=libraries, library_dirs=library_dirs,
-                    define_macros=DEFINE_MACROS)
-    extensions.append(ext)
-
-for source in statespace_exts:
+def make_extension(source, **config):
+    """Create an Extension from a pyx or pyx.in source and its settings"""
     source, ext = check_source(source)
     source = process_tempita(source)
     name = source.replace('/', '.').replace(ext, '')
+    return Extension(name, [source], define_macros=DEFINE_MACROS, **config)
 
-    EXT_REQUIRES_NUMPY_MATH_LIBS.append(name)
-    ext = Extension(name, [source],
-                    include_dirs=['statsmodels/src'], depends=[],
-                    libraries=[], library_dirs=[],
-                    define_macros=DEFINE_MACROS)
-    extensions.append(ext)
 
-if HAS_CYTHON:
+extensions = []
+if not NO_FRILLS:
+    extensions += [make_extension(**config) for config in exts.values()]
+    extensions += [make_extension(source, **statespace_ext_config)
+                   for source in statespace_exts]
+# All extensions use the numpy math library
+EXT_REQUIRES_NUMPY_MATH_LIBS = [ext.name for ext in extensions]
+
+if HAS_CYTHON and not NO_FRILLS:
     extensions = cythonize(extensions, compiler_directives=COMPILER_DIRECTIVES,
-                           language_level=3, force=CYTHON_COVERAGE)
+                           language_level=3, force=CYTHON_COVERAGE,
+                           nthreads=CYTHON_JOBS)
 
 ##############################################################################
 # Construct package data
 ##############################################################################
 package_data = defaultdict(list)
 filetypes = ['*.csv', '*.txt', '*.dta']
-for root, _, filenames in os.walk(pjoin(os.getcwd(), 'statsmodels', 'datasets')):  # noqa: E501
-    matches = []
+if not NO_FRILLS:
+    package_dirs = set()
     for filetype in filetypes:
-        for filename in fnmatch.filter(filenames, filetype):
-            matches.append(filename)
-    if matches:
-        package_data['.'.join(relpath(root).split(os.path.sep))] = filetypes
-for root, _, _ in os.walk(pjoin(os.getcwd(), 'statsmodels')):
-    if root.endswith('results'):
-        package_data['.'.join(relpath(root).split(os.path.sep))] = filetypes
-
-for path, filetypes in ADDITIONAL_PACKAGE_DATA.items():
-    package_data[path].extend(filetypes)
+        pattern = pjoin('statsmodels', 'datasets', '**', filetype)
+        for filename in glob.iglob(pattern, recursive=True):
+            package_dirs.add(os.path.dirname(filename))
+    # The trailing separator restricts matches to directories
+    pattern = pjoin('statsmodels', '**', '*results') + os.path.sep
+    for dirname in glob.iglob(pattern, recursive=True):
+        package_dirs.add(dirname.rstrip(os.path.sep))
+    for dirname in sorted(package_dirs):
+        package_data[dirname.replace(os.path.sep, '.')] = filetypes
+
+    for path, filetypes in ADDITIONAL_PACKAGE_DATA.items():
+        package_data[path].extend(filetypes)
 
 if os.path.exists('MANIFEST'):
     os.unlink('MANIFEST')